@@ -3,7 +3,7 @@
 Process an image using different effects
 """
 from functools import wraps
-from typing import Callable, Union
+from typing import Callable, List, Optional, Union
 
 import cv2 as cv  # type: ignore
 import numpy as np
@@ -29,23 +29,27 @@ class ImgProcessor:
     """Level of 'weight' that a effect has.
     These KPI are merely author's criteria and can be overwritten."""
 
-    def __init__(self, img: bytes):
+    def __init__(self, img: Union[bytes, memoryview], encode_params: Optional[List[int]] = None):
         """
         Args:
-            - img (bytes): Image to be processed
+            - img (bytes-like): Image to be processed. Memoryviews are decoded without copying
+            - encode_params (List[int]): Encoder flags and values passed to cv.imencode,
+                e.g. [cv.IMWRITE_JPEG_QUALITY, 70]. Can be changed later through the
+                encode_params attribute. Default: encoder defaults
         """
 
         self.__src_img = self.__img_decode(img)
         self.__dst_img = img
+        self.encode_params = encode_params or []
 
         if isinstance(self.__src_img, type(None)):
             raise ValueError("No se pudo interpretar la imagen adecaudamente.")
 
-    def __img_decode(self, img: bytes) -> np.ndarray:
+    def __img_decode(self, img: Union[bytes, memoryview]) -> np.ndarray:
         """Convert an image into numpy array compatible with OpenCV
 
         Args:
-            - img (bytes): Image to be converted
+            - img (bytes-like): Image to be converted
 
         Returns:
             - numpy array: Image converted to an OpenCV format
@@ -104,7 +108,7 @@ class ImgProcessor:
             "pic",
         ]
         fmt = "jpg" if str(fmt).lower() not in accepted_fmt else fmt.lower()
-        return cv.imencode("." + fmt, img)[1]
+        return cv.imencode("." + fmt, img, self.encode_params)[1]
 
     def __store_result(func: Callable) -> Callable:  # type: ignore[misc]
         """Decorator to keep a byte copy of the customized image"""
@@ -1,13 +1,54 @@
-from flask import Flask, request
-from ..middleware.response import RequestHandler 
+from contextlib import nullcontext
+from os import environ
+from flask import Flask, Response, request
+from ..middleware.buffers import (
+    BufferPool,
+    PooledBuffer,
+    iter_chunks,
+    loads_with_b64_field,
+    read_into,
+)
+from ..middleware.overload import OverloadController
+from ..middleware.response import RequestHandler
+from ..middleware.similarity import PerceptualIndex
 
 app = Flask(__name__)
+pool = BufferPool()
+# The near-duplicate index is only enabled when UB_PHASH_INDEX points to its database file
+phash_index = PerceptualIndex(environ["UB_PHASH_INDEX"]) if "UB_PHASH_INDEX" in environ else None
+# Overload degradation is only enabled when UB_OVERLOAD_DEPTH sets the requests in flight
+# from which it applies. UB_OVERLOAD_REJECT_DEPTH and UB_OVERLOAD_LATENCY (seconds) tune it
+overload = (
+    OverloadController(
+        degrade_depth=int(environ["UB_OVERLOAD_DEPTH"]),
+        reject_depth=int(environ.get("UB_OVERLOAD_REJECT_DEPTH", "16")),
+        latency_threshold=float(environ.get("UB_OVERLOAD_LATENCY", "2.0")),
+    )
+    if "UB_OVERLOAD_DEPTH" in environ
+    else None
+)
 
 @app.route('/', methods=["POST"])
 def index():
-    a = request.get_json()
-    r = RequestHandler(a)
-    return r.build_response()
+    # The upload is read into a pooled buffer and the image is decoded straight from it
+    body = read_into(request.stream, pool, request.content_length) if request.is_json else None
+    try:
+        try:
+            a = loads_with_b64_field(body.view(), "img") if body is not None else None
+        except ValueError:
+            a = None
+        r = RequestHandler(a, pool=pool, index=phash_index, overload=overload)
+        with overload.track() if overload is not None else nullcontext():
+            result = r.build_response()
+    finally:
+        if body is not None:
+            body.release()
+    if isinstance(result, PooledBuffer):
+        headers = {"Content-Length": str(result.length)}
+        response = Response(iter_chunks(result), mimetype="application/json", headers=headers)
+        response.call_on_close(result.release)
+        return response
+    return result
 
 
 @app.route('/ping')
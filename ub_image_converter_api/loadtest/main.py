@@ -0,0 +1,334 @@
+"""
+Drive the Flask app end-to-end under increasing concurrency and report
+throughput, latency percentiles, error rates and degraded responses
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from base64 import b64encode
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from inspect import getfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2 as cv  # type: ignore
+import numpy as np
+from werkzeug.serving import make_server
+
+from ..effects_processor.main import ImgProcessor
+from ..endpoints.app import app
+
+DEFAULT_SIZES = [(320, 240), (1280, 720), (1920, 1080)]
+"""Width and height of the synthesized images"""
+
+MAX_WEIGHT = 50
+"""Weight limit enforced by the RequestHandler"""
+
+
+def synthesize_mix(
+    count: int = 20, sizes: Optional[List[Tuple[int, int]]] = None, seed: int = 0
+) -> List[dict]:
+    """Build requests with random images and random effect chains under the weight limit
+
+    Args:
+        - count (int): Number of requests. Default: 20
+        - sizes (List[Tuple[int, int]]): Width and height of the images. Default: DEFAULT_SIZES
+        - seed (int): Seed of the random generator. Default: 0
+
+    Returns:
+        - List[dict]: Requests in the format expected by the API
+    """
+
+    rnd = random.Random(seed)
+    images = dict()
+    for width, height in sizes or DEFAULT_SIZES:
+        pixels = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        images[(width, height)] = b64encode(cv.imencode(".jpg", pixels)[1]).decode()
+
+    effects = list(ImgProcessor.effect_weight)
+    mix = []
+    for _ in range(count):
+        chain: List[str] = []
+        weight = 0
+        for effect in rnd.sample(effects, rnd.randint(1, 3)):
+            if weight + ImgProcessor.effect_weight[effect] <= MAX_WEIGHT:
+                chain.append(effect)
+                weight += ImgProcessor.effect_weight[effect]
+        mix.append({"img": images[rnd.choice(list(images))], "effects": chain})
+    return mix
+
+
+def load_mix(path: str) -> List[dict]:
+    """Read requests from a Json lines file
+
+    Each line holds "effects" and the image as either "img" (base64),
+    "image" (path to a file, relative to the requests file) or "size" ([width, height]).
+
+    Args:
+        - path (str): Requests file
+
+    Returns:
+        - List[dict]: Requests in the format expected by the API
+    """
+
+    mix = []
+    folder = Path(path).parent
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "image" in entry:
+                with open(folder / entry["image"], "rb") as img:
+                    entry["img"] = b64encode(img.read()).decode()
+            elif "size" in entry:
+                entry["img"] = synthesize_mix(1, [tuple(entry["size"])])[0]["img"]
+            mix.append({"img": entry["img"], "effects": entry.get("effects", [])})
+    return mix
+
+
+class InProcessTarget:
+    """Send requests through Flask's test client"""
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def __enter__(self) -> "InProcessTarget":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def send(self, body: bytes) -> Tuple[int, bytes]:
+        """Post a request body and return the status code and response body"""
+
+        response = self.client.post("/", data=body, content_type="application/json")
+        return response.status_code, response.get_data()
+
+
+class ServerTarget:
+    """Send requests over HTTP to the app served by a real local server"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            - host (str): Interface to listen on. Default: 127.0.0.1
+            - port (int): Port to listen on. Default: 0, any free port
+        """
+        self.server = make_server(host, port, app, threaded=True)
+        self.url = f"http://{host}:{self.server.server_port}/"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "ServerTarget":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self._thread.join()
+
+    def send(self, body: bytes) -> Tuple[int, bytes]:
+        """Post a request body and return the status code and response body"""
+
+        req = urllib.request.Request(
+            self.url, data=body, headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(req) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as err:
+            return err.code, err.read()
+
+
+class SamplingProfiler:
+    """Sample the stacks of every other thread and group them by the effect running"""
+
+    def __init__(self, interval: float = 0.005):
+        """
+        Args:
+            - interval (float): Seconds between samples. Default: 0.005
+        """
+        self.interval = interval
+        self._effects_file = getfile(ImgProcessor)
+        self.stacks: Dict[str, Counter] = defaultdict(Counter)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident != own:
+                    self._sample(frame)
+
+    def _sample(self, frame) -> None:
+        names = []
+        effect = None
+        while frame is not None:
+            code = frame.f_code
+            if (
+                effect is None
+                and code.co_name in ImgProcessor.effect_weight
+                and code.co_filename == self._effects_file
+            ):
+                effect = code.co_name
+            names.append(f"{Path(code.co_filename).name}:{code.co_name}")
+            frame = frame.f_back
+        if effect is not None:
+            self.stacks[effect][";".join(reversed(names))] += 1
+
+    def write(self, folder: str) -> List[str]:
+        """Write one folded stacks file per effect, ready for flamegraph.pl or speedscope
+
+        Args:
+            - folder (str): Output folder, created if needed
+
+        Returns:
+            - List[str]: Paths of the written files
+        """
+
+        Path(folder).mkdir(parents=True, exist_ok=True)
+        paths = []
+        for effect, stacks in sorted(self.stacks.items()):
+            path = Path(folder) / f"{effect}.folded"
+            with open(path, "w") as f:
+                for stack, samples in stacks.most_common():
+                    f.write(f"{stack} {samples}\n")
+            paths.append(str(path))
+        return paths
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values. 0 for an empty list"""
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(np.ceil(pct / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def _classify(status: int, body: bytes) -> Tuple[bool, bool]:
+    """Whether a response is an error and whether it was degraded under overload"""
+
+    if status != 200:
+        return True, False
+    try:
+        response = json.loads(body)
+    except ValueError:
+        return True, False
+    return "cod" in response, response.get("degraded") is True
+
+
+def run_level(target, mix: List[dict], concurrency: int, requests: int) -> dict:
+    """Replay the request mix with a fixed number of concurrent clients
+
+    Args:
+        - target (InProcessTarget | ServerTarget): Where requests are sent
+        - mix (List[dict]): Requests, replayed round-robin
+        - concurrency (int): Concurrent clients
+        - requests (int): Total requests sent
+
+    Returns:
+        - dict: Throughput, latency percentiles (ms), error rate and degraded rate of the level
+    """
+
+    bodies = [json.dumps(r).encode() for r in mix]
+
+    def one(n: int) -> Tuple[float, bool, bool]:
+        start = time.perf_counter()
+        try:
+            error, degraded = _classify(*target.send(bodies[n % len(bodies)]))
+        except Exception:  # pylint: disable=broad-except
+            error, degraded = True, False
+        return time.perf_counter() - start, error, degraded
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency * 1000 for latency, _, _ in results]
+    errors = sum(error for _, error, _ in results)
+    degraded = sum(degraded for _, _, degraded in results)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "error_rate": errors / requests if requests else 0.0,
+        "degraded": degraded,
+        "degraded_rate": degraded / requests if requests else 0.0,
+        "throughput": requests / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies, default=0.0),
+    }
+
+
+def run(
+    mix: List[dict],
+    levels: List[int],
+    requests: int,
+    server: bool = False,
+    profile_dir: Optional[str] = None,
+) -> List[dict]:
+    """Run the load test at each concurrency level
+
+    Args:
+        - mix (List[dict]): Requests, replayed round-robin
+        - levels (List[int]): Concurrency levels, run in order
+        - requests (int): Requests sent at each level
+        - server (bool): If True, requests go over HTTP to a real local server.
+            Otherwise through Flask's test client. Default: False
+        - profile_dir (str): If given, stacks are sampled during the run and
+            written there as one folded file per effect. Default: None
+
+    Returns:
+        - List[dict]: Report of each level
+    """
+
+    profiler = SamplingProfiler() if profile_dir else None
+    target = ServerTarget() if server else InProcessTarget()
+    with target, profiler or nullcontext():
+        report = [run_level(target, mix, level, requests) for level in levels]
+    if profiler is not None:
+        profiler.write(profile_dir)  # type: ignore[arg-type]
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests-file", help="Json lines file with the requests to replay")
+    parser.add_argument("--synthesize", type=int, default=20, help="Requests synthesized otherwise")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Comma separated levels")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per level")
+    parser.add_argument("--server", action="store_true", help="Use a real local server")
+    parser.add_argument("--profile-dir", help="Write folded stacks per effect to this folder")
+    args = parser.parse_args(argv)
+
+    mix = load_mix(args.requests_file) if args.requests_file else synthesize_mix(args.synthesize)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    report = run(mix, levels, args.requests, args.server, args.profile_dir)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
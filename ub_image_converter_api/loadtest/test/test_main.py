@@ -0,0 +1,93 @@
+"""
+Unittests for the load generator
+"""
+import json
+
+import pytest
+
+from ...endpoints import app as app_module
+from ...middleware.overload import OverloadController
+
+from ..main import load_mix, main, percentile, run, synthesize_mix
+
+
+mix = synthesize_mix(4, sizes=[(64, 48)])
+
+
+def test_synthesize_mix():
+    """Synthesized requests stay under the weight limit"""
+    assert len(mix) == 4
+    assert all(request["img"] and request["effects"] for request in mix)
+    assert mix == synthesize_mix(4, sizes=[(64, 48)])
+
+
+def test_load_mix(tmp_path):
+    """Requests file accepts base64, image paths and sizes"""
+    (tmp_path / "img.jpg").write_bytes(b"not really an image")
+    lines = [
+        {"img": mix[0]["img"], "effects": ["negative"]},
+        {"image": "img.jpg", "effects": ["blur"]},
+        {"size": [32, 32]},
+    ]
+    path = tmp_path / "requests.jsonl"
+    path.write_text("\n".join(json.dumps(line) for line in lines) + "\n\n")
+    loaded = load_mix(str(path))
+    assert [r["effects"] for r in loaded] == [["negative"], ["blur"], []]
+    assert loaded[0]["img"] == mix[0]["img"]
+
+
+def test_percentile():
+    """Nearest-rank percentiles"""
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50 and percentile(values, 99) == 99
+    assert percentile([], 50) == 0
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.parametrize("server", [False, True])
+def test_run(server):
+    """Both targets serve the mix without errors and report every level"""
+    report = run(mix, levels=[1, 2], requests=4, server=server)
+    assert [level["concurrency"] for level in report] == [1, 2]
+    for level in report:
+        assert level["errors"] == 0 and level["throughput"] > 0
+        assert level["degraded"] == 0 and level["degraded_rate"] == 0
+        assert level["p50"] <= level["p90"] <= level["p99"] <= level["max"]
+
+
+@pytest.mark.timeout(30)
+def test_run_errors():
+    """Error responses are counted"""
+    report = run([{"img": mix[0]["img"], "effects": []}], levels=[1], requests=2)
+    assert report[0]["errors"] == 2 and report[0]["error_rate"] == 1
+
+
+@pytest.mark.timeout(30)
+def test_run_degraded(monkeypatch):
+    """Degraded responses are counted apart from errors"""
+    monkeypatch.setattr(app_module, "overload", OverloadController(degrade_depth=1))
+    report = run(mix[:1], levels=[1], requests=2)
+    assert report[0]["errors"] == 0
+    assert report[0]["degraded"] == 2 and report[0]["degraded_rate"] == 1
+
+
+@pytest.mark.timeout(60)
+def test_main_profile(tmp_path, capsys):
+    """The profiler writes folded stacks per effect"""
+    requests = tmp_path / "requests.jsonl"
+    requests.write_text(json.dumps({"size": [1280, 720], "effects": ["noise"]}))
+    main(
+        [
+            "--requests-file",
+            str(requests),
+            "--concurrency",
+            "1",
+            "--requests",
+            "5",
+            "--profile-dir",
+            str(tmp_path / "profile"),
+        ]
+    )
+    assert json.loads(capsys.readouterr().out)[0]["errors"] == 0
+    folded = (tmp_path / "profile" / "noise.folded").read_text()
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in folded.splitlines())
@@ -0,0 +1,291 @@
+"""
+Pooled buffers to move image bytes between the HTTP layer and the processor
+without allocating a new bytes object for every step of the request
+"""
+import re
+from binascii import Error as BinasciiError, a2b_base64, b2a_base64
+from json import loads
+from threading import Lock
+from typing import IO, Dict, Iterator, List, Optional, Union
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+_PADDING = re.compile(b"=")
+
+
+class PooledBuffer:
+    """A block of memory borrowed from a BufferPool"""
+
+    def __init__(self, pool: "BufferPool", block: memoryview):
+        """
+        Args:
+            - pool (BufferPool): Pool the block is returned to on release
+            - block (memoryview): Writable memory owned by this buffer
+        """
+        self.pool: Optional["BufferPool"] = pool
+        self.block = block
+        self.length = 0
+
+    @property
+    def capacity(self) -> int:
+        """Size in bytes of the underlying block"""
+
+        return len(self.block)
+
+    def view(self) -> memoryview:
+        """Return a zero-copy view over the written part of the buffer"""
+
+        return self.block[: self.length]
+
+    def write(self, data: BytesLike) -> None:
+        """Append data at the end of the written part of the buffer
+
+        Args:
+            - data (bytes-like): Data to be appended
+        """
+
+        end = self.length + len(data)
+        self.block[self.length : end] = data
+        self.length = end
+
+    def release(self) -> None:
+        """Give the block back to its pool. The buffer must not be used afterwards.
+        Releasing an already released buffer does nothing"""
+
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.release(self)
+
+    def __enter__(self) -> "PooledBuffer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class BufferPool:
+    """Keep reusable blocks of memory grouped by size class"""
+
+    def __init__(self, min_size: int = 1 << 16, max_free: int = 4, max_retained: int = 1 << 25):
+        """
+        Args:
+            - min_size (int): Smallest block handed out, in bytes. Default: 64 KiB
+            - max_free (int): Free blocks kept per size class. Default: 4
+            - max_retained (int): Total size of the free blocks kept, in bytes. Blocks
+                that don't fit are discarded and their memory returned. Default: 32 MiB
+        """
+        self.min_size = max(1, min_size)
+        self.max_free = max(0, max_free)
+        self.max_retained = max(0, max_retained)
+        self.retained = 0
+        self._free: Dict[int, List[PooledBuffer]] = dict()
+        self._lock = Lock()
+
+    def _size_class(self, size: int) -> int:
+        """Round a size up to the next power of two, not smaller than min_size"""
+
+        capacity = self.min_size
+        while capacity < size:
+            capacity <<= 1
+        return capacity
+
+    def _allocate(self, capacity: int) -> PooledBuffer:
+        return PooledBuffer(self, memoryview(bytearray(capacity)))
+
+    def acquire(self, size: int) -> PooledBuffer:
+        """Borrow an empty buffer able to hold at least `size` bytes
+
+        Args:
+            - size (int): Minimum capacity needed, in bytes
+
+        Returns:
+            - PooledBuffer: Empty buffer. Call release() when done with it
+        """
+
+        capacity = self._size_class(size)
+        with self._lock:
+            free = self._free.get(capacity)
+            buf = free.pop() if free else None
+            if buf is not None:
+                self.retained -= capacity
+        if buf is None:
+            buf = self._allocate(capacity)
+        buf.pool = self
+        buf.length = 0
+        return buf
+
+    def release(self, buf: PooledBuffer) -> None:
+        """Take a buffer back. Blocks over the max_free or max_retained limits are discarded
+
+        Args:
+            - buf (PooledBuffer): Buffer previously handed out by this pool
+        """
+
+        with self._lock:
+            free = self._free.setdefault(buf.capacity, [])
+            if len(free) < self.max_free and self.retained + buf.capacity <= self.max_retained:
+                free.append(buf)
+                self.retained += buf.capacity
+
+    def close(self) -> None:
+        """Drop every free block"""
+
+        with self._lock:
+            self._free.clear()
+            self.retained = 0
+
+
+def _readinto(stream: IO[bytes], view: memoryview) -> int:
+    readinto = getattr(stream, "readinto", None)
+    if readinto is not None:
+        return readinto(view) or 0
+    data = stream.read(len(view))
+    view[: len(data)] = data
+    return len(data)
+
+
+def read_into(stream: IO[bytes], pool: BufferPool, length: Optional[int] = None) -> PooledBuffer:
+    """Read a stream, such as an upload, into a pooled buffer
+
+    Args:
+        - stream (file-like): Stream to read until its end or `length` bytes
+        - pool (BufferPool): Pool to borrow the buffer from
+        - length (int): Expected size, e.g. the Content-Length. Default: unknown
+
+    Returns:
+        - PooledBuffer: Buffer holding what was read
+    """
+
+    buf = pool.acquire(length or pool.min_size)
+    try:
+        while length is None or buf.length < length:
+            if buf.length == buf.capacity:
+                bigger = pool.acquire(buf.capacity * 2)
+                bigger.write(buf.view())
+                buf.release()
+                buf = bigger
+            end = buf.capacity if length is None else length
+            read = _readinto(stream, buf.block[buf.length : end])
+            if not read:
+                break
+            buf.length += read
+    except BaseException:
+        buf.release()
+        raise
+    return buf
+
+
+def loads_with_b64_field(data: memoryview, field: str) -> object:
+    """Parse a Json document, leaving one base64 string field as a view over `data`
+
+    The field is cut out before parsing so that it is never copied into a str.
+    Documents where the field isn't a plain top-level base64 string are parsed as usual.
+
+    Args:
+        - data (memoryview): Json document, utf-8 encoded
+        - field (str): Name of the field
+
+    Returns:
+        - object: Parsed document. When found, the field holds a memoryview
+    """
+
+    key = re.compile(rb'"%s"\s*:\s*"([A-Za-z0-9+/=]*)"' % re.escape(field.encode()))
+    match = key.search(data)
+    if match is None:
+        return loads(bytes(data))
+    start, end = match.span(1)
+    document = loads(bytes(data[:start]) + bytes(data[end:]))
+    if not isinstance(document, dict) or document.get(field) != "":
+        # The match was not the top-level field, e.g. it was inside another string
+        return loads(bytes(data))
+    document[field] = data[start:end]
+    return document
+
+
+def b64decode_into(
+    data: Union[str, BytesLike], pool: BufferPool, chunk: int = 1 << 16
+) -> PooledBuffer:
+    """Decode base64 data into a pooled buffer, one chunk at a time.
+    Only one chunk of the encoded data is copied at any time.
+
+    Args:
+        - data (str | bytes-like): Base64 encoded data. Strings must be ASCII
+        - pool (BufferPool): Pool to borrow the buffer from
+        - chunk (int): Encoded characters decoded per step. Rounded down to
+            a multiple of 4. Default: 64 KiB
+
+    Returns:
+        - PooledBuffer: Buffer holding the decoded data
+    """
+
+    chunk = max(4, chunk - chunk % 4)
+    last = max(0, len(data) - 1) // chunk * chunk
+    if isinstance(data, str):
+        padded_early = data.find("=", 0, last) != -1
+    else:
+        data = memoryview(data).cast("B")
+        padded_early = _PADDING.search(data, 0, last) is not None
+    buf = pool.acquire(len(data) * 3 // 4)
+    try:
+        # Decoding stops at the first padding, so data padded early can't be split
+        if not padded_early:
+            try:
+                for start in range(0, len(data), chunk):
+                    buf.write(a2b_base64(data[start : start + chunk]))
+                return buf
+            except BinasciiError:
+                # Characters outside the base64 alphabet broke the chunk alignment
+                buf.length = 0
+        buf.write(a2b_base64(data))
+    except BaseException:
+        buf.release()
+        raise
+    return buf
+
+
+def b64encode_into(
+    data: BytesLike,
+    pool: BufferPool,
+    prefix: bytes = b"",
+    suffix: bytes = b"",
+    chunk: int = 3 << 14,
+) -> PooledBuffer:
+    """Base64 encode data into a pooled buffer, between a prefix and a suffix
+
+    Args:
+        - data (bytes-like): Data to be encoded. Any object exposing the buffer
+            protocol, such as the numpy array returned by cv.imencode
+        - pool (BufferPool): Pool to borrow the buffer from
+        - prefix (bytes): Written before the encoded data. Default: empty
+        - suffix (bytes): Written after the encoded data. Default: empty
+        - chunk (int): Bytes encoded per step. Rounded down to a multiple of 3. Default: 48 KiB
+
+    Returns:
+        - PooledBuffer: Buffer holding prefix, encoded data and suffix
+    """
+
+    data = memoryview(data).cast("B")
+    chunk = max(3, chunk - chunk % 3)
+    buf = pool.acquire(len(prefix) + (len(data) + 2) // 3 * 4 + len(suffix))
+    buf.write(prefix)
+    for start in range(0, len(data), chunk):
+        buf.write(b2a_base64(data[start : start + chunk], newline=False))
+    buf.write(suffix)
+    return buf
+
+
+def iter_chunks(buf: PooledBuffer, chunk: int = 1 << 16) -> Iterator[bytes]:
+    """Yield the content of a buffer in bounded chunks.
+    WSGI servers only accept bytes, so each chunk is copied but never the whole buffer.
+
+    Args:
+        - buf (PooledBuffer): Buffer to stream
+        - chunk (int): Bytes per yielded chunk. Default: 64 KiB
+
+    Returns:
+        - Iterator[bytes]: Content of the buffer
+    """
+
+    with buf.view() as view:
+        for start in range(0, len(view), chunk):
+            yield bytes(view[start : start + chunk])
@@ -0,0 +1,102 @@
+"""
+Degrade processing quality when the service is saturated, to keep latency bounded
+"""
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from typing import Deque, Dict, Iterator, List, Optional
+
+import cv2 as cv  # type: ignore
+
+
+class DegradePolicy:
+    """How requests are processed while the service is overloaded"""
+
+    def __init__(
+        self,
+        max_side: int = 1280,
+        kernels: Optional[Dict[str, int]] = None,
+        encode_params: Optional[List[int]] = None,
+        reject_low_priority: bool = False,
+    ):
+        """
+        Args:
+            - max_side (int): Images are scaled down before the effects so that
+                their longest side is at most this many pixels. Default: 1280
+            - kernels (Dict[str, int]): Kernel size passed as factor to each effect.
+                Default: blur 9, laplacian 3, sobel 1
+            - encode_params (List[int]): Encoder settings for the final output only.
+                Default: Jpeg quality 70, for smaller responses
+            - reject_low_priority (bool): If True, requests with "priority": "low"
+                are rejected. Default: False
+        """
+        self.max_side = max_side
+        self.kernels = kernels if kernels is not None else {"blur": 9, "laplacian": 3, "sobel": 1}
+        self.encode_params = (
+            encode_params if encode_params is not None else [cv.IMWRITE_JPEG_QUALITY, 70]
+        )
+        self.reject_low_priority = reject_low_priority
+
+
+class OverloadController:
+    """Watch requests in flight and recent latencies to pick a DegradePolicy"""
+
+    def __init__(
+        self,
+        degrade_depth: int = 4,
+        reject_depth: int = 16,
+        latency_threshold: float = 2.0,
+        window: int = 100,
+    ):
+        """
+        Args:
+            - degrade_depth (int): Requests in flight from which processing is degraded. Default: 4
+            - reject_depth (int): Requests in flight from which low priority requests
+                are rejected. Default: 16
+            - latency_threshold (float): Seconds. Processing is also degraded while the
+                90th percentile of the recent latencies exceeds it. Default: 2.0
+            - window (int): Number of recent latencies kept. Default: 100
+        """
+        self.degrade_depth = max(1, degrade_depth)
+        self.reject_depth = max(self.degrade_depth, reject_depth)
+        self.latency_threshold = latency_threshold
+        self.in_flight = 0
+        self.latencies: Deque[float] = deque(maxlen=max(1, window))
+        self._lock = Lock()
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """Count a request as in flight and record its latency once done"""
+
+        start = perf_counter()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.latencies.append(perf_counter() - start)
+
+    def _recent_latency(self) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[int(0.9 * (len(ordered) - 1))]
+
+    def policy(self) -> Optional[DegradePolicy]:
+        """Policy for the current load
+
+        Returns:
+            - DegradePolicy: How to degrade processing, or None under normal load
+        """
+
+        with self._lock:
+            in_flight = self.in_flight
+            latency = self._recent_latency()
+        if in_flight >= self.reject_depth:
+            return DegradePolicy(reject_low_priority=True)
+        if in_flight >= self.degrade_depth or latency > self.latency_threshold:
+            return DegradePolicy()
+        return None
@@ -3,8 +3,11 @@ Handle requests based on a json format
 """
 from base64 import b64decode, b64encode
 from json import dumps
-from typing import Dict, List
+from typing import Dict, List, Optional
 from ..effects_processor.main import ImgProcessor
+from .overload import DegradePolicy, OverloadController
+from .buffers import BufferPool, PooledBuffer, b64decode_into, b64encode_into
+from .similarity import PerceptualIndex, image_hashes
 
 
 class RequestHandler:
@@ -15,15 +18,31 @@ class RequestHandler:
         "noImage": [1, "No image to process"],
         "noEffects": [2, "No effects given"],
         "weightExceeded": [3, "Sum of effect's weight exceeds limit"],
-        "malformedJson": [4, "Invalid Json format"]
+        "malformedJson": [4, "Invalid Json format"],
+        "overloaded": [5, "Server overloaded, try again later"]
     }
 
-    def __init__(self, request: dict):
+    def __init__(
+        self,
+        request: dict,
+        pool: Optional[BufferPool] = None,
+        index: Optional[PerceptualIndex] = None,
+        overload: Optional[OverloadController] = None
+    ):
         """
         Args:
             - request (dict): requets to be processed
+            - pool (BufferPool): If given, the image is decoded into and the response
+                is built in pooled buffers instead of new bytes objects. Default: None
+            - index (PerceptualIndex): If given, processed images are stored in it and
+                requests with "approximate": true are served from near-identical ones. Default: None
+            - overload (OverloadController): If given, processing is degraded under load
+                and requests with "priority": "low" may be rejected. Default: None
         """
         self.request = request
+        self.pool = pool
+        self.index = index
+        self.overload = overload
         self.effect_weight_map = ImgProcessor.effect_weight
         
     def _effects_weight_apply_map(self, effects_to_apply: List[str]) -> Dict[str, int]:
@@ -103,11 +122,13 @@ class RequestHandler:
         return sum(self._getEffectsWeight(effects_to_apply))
 
     
-    def _build_success_template(self, img: bytes) -> Dict:
+    def _build_success_template(self, img: bytes, reused: bool=False, degraded: bool=False) -> Dict:
         ''''Success response Template
 
         Args:
             - img (bytes): image to process
+            - reused (bool): True if the image is the output of a near-identical one. Default: False
+            - degraded (bool): True if the image was processed at lower quality. Default: False
 
         Returns:
             - dict: Success template template
@@ -117,9 +138,34 @@ class RequestHandler:
             "img": img_b64,
             "msg": "Image processed correctly"
         }
+        if reused:
+            success_template["reused"] = True
+        if degraded:
+            success_template["degraded"] = True
         return dumps(success_template)
 
 
+    def _build_success_buffer(
+        self, img: bytes, reused: bool=False, degraded: bool=False
+    ) -> PooledBuffer:
+        '''Success response Template written into a pooled buffer
+
+        Args:
+            - img (bytes-like): processed image
+            - reused (bool): True if the image is the output of a near-identical one. Default: False
+            - degraded (bool): True if the image was processed at lower quality. Default: False
+
+        Returns:
+            - PooledBuffer: Success template as Json. Must be released by the caller
+        '''
+        suffix = b'", "msg": "Image processed correctly"'
+        if reused:
+            suffix += b', "reused": true'
+        if degraded:
+            suffix += b', "degraded": true'
+        return b64encode_into(img, self.pool, prefix=b'{"img": "', suffix=suffix + b'}')
+
+
     def build_response(self):
         if isinstance(self.request, dict):
             data = self.request
@@ -130,12 +176,48 @@ class RequestHandler:
             response_template = self._build_error_template("notJson")
             return response_template
 
-        img = b64decode(data.get("img", None))
+        policy = self.overload.policy() if self.overload is not None else None
+        if policy is not None and policy.reject_low_priority and data.get("priority") == "low":
+            response_template = self._build_error_template("overloaded")
+            return response_template
+
+        effects: List[str] = data.get("effects", [])
+        approximate = data.get("approximate") is True
+        if self.pool is None:
+            img = b64decode(data.get("img", None))
+            return self._process(img, effects, approximate, policy)
+
+        img_buf = b64decode_into(data.get("img", None), self.pool)
+        try:
+            return self._process(img_buf.view(), effects, approximate, policy)
+        finally:
+            img_buf.release()
+
+
+    def _process(
+        self,
+        img: bytes,
+        effects: List[str],
+        approximate: bool=False,
+        policy: Optional[DegradePolicy]=None
+    ):
+        '''Apply the effects to the decoded image and build the response
+
+        Args:
+            - img (bytes-like): image to process
+            - effects (List[str]): effects to apply to image
+            - approximate (bool): Allow serving the output of a near-identical image. Default: False
+            - policy (DegradePolicy): If given, the image is processed at lower quality.
+                Default: None
+
+        Returns:
+            - dict | str | PooledBuffer: Error template, or success template
+                (pooled when the handler has a pool)
+        '''
         if not img:
             response_template = self._build_error_template("noImage")
             return response_template           
 
-        effects: List[str] = data.get("effects", [])
         if not effects:
             response_template = self._build_error_template("noEffects")
             return response_template  
@@ -144,11 +226,65 @@ class RequestHandler:
             return response_template  
          
         i_p = ImgProcessor(img)
+        if self.index is not None:
+            height, width = i_p.src_image().shape[:2]
+            key = (*image_hashes(i_p.src_image()), effects, width, height)
+            reused = self.index.lookup(*key) if approximate else None
+            if reused is not None:
+                return self._build_success(reused, reused=True)
+
+        if policy is not None:
+            return self._build_success(self._apply_degraded(i_p, effects, policy), degraded=True)
+
         for e in effects:
             getattr(i_p, e)()
             i_p = ImgProcessor(i_p.dst_image())
 
-        return self._build_success_template(i_p.dst_image())
+        if self.index is not None:
+            self.index.add(*key, i_p.dst_image())
+        return self._build_success(i_p.dst_image())
+
+
+    def _apply_degraded(self, i_p: ImgProcessor, effects: List[str], policy: DegradePolicy):
+        '''Apply the effects following an overload policy: the image is scaled down first,
+        kernel based effects use smaller kernels and the final output uses the policy's
+        encoder settings. Intermediate images keep the default ones
+
+        Args:
+            - i_p (ImgProcessor): processor holding the decoded image
+            - effects (List[str]): effects to apply to image
+            - policy (DegradePolicy): how to degrade processing
+
+        Returns:
+            - numpy array: processed image encoded
+        '''
+        height, width = i_p.src_image().shape[:2]
+        if max(height, width) > policy.max_side:
+            i_p.scale(policy.max_side / max(height, width))
+            i_p = ImgProcessor(i_p.dst_image())
+        for n, e in enumerate(effects):
+            if n == len(effects) - 1:
+                i_p.encode_params = policy.encode_params
+            kwargs = {"factor": policy.kernels[e]} if e in policy.kernels else {}
+            getattr(i_p, e)(**kwargs)
+            i_p = ImgProcessor(i_p.dst_image())
+        return i_p.dst_image()
+
+
+    def _build_success(self, img: bytes, reused: bool=False, degraded: bool=False):
+        '''Success response, pooled when the handler has a pool
+
+        Args:
+            - img (bytes-like): processed image
+            - reused (bool): True if the image is the output of a near-identical one. Default: False
+            - degraded (bool): True if the image was processed at lower quality. Default: False
+
+        Returns:
+            - str | PooledBuffer: Success template
+        '''
+        if self.pool is not None:
+            return self._build_success_buffer(img, reused, degraded)
+        return self._build_success_template(img, reused, degraded)
 
 if __name__ == "__main__":
 
@@ -0,0 +1,184 @@
+"""
+Perceptual hashes and a near-duplicate index to reuse the output of images
+that were already processed, even when re-encoded by a different client
+"""
+import sqlite3
+from json import dumps
+from threading import Lock
+from typing import List, Optional, Tuple
+
+import cv2 as cv  # type: ignore
+import numpy as np
+
+HASH_SOURCE_SIDE = 64
+"""Longest side, in pixels, the image is scaled down to before hashing"""
+
+BANDS = 4
+"""Number of 16 bits bands the dHash is split into to find candidates"""
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def image_hashes(img: np.ndarray, size: int = 8) -> Tuple[int, int]:
+    """Compute the aHash and dHash of an image
+
+    Args:
+        - img (np.ndarray): Image as an OpenCV numpy array, e.g. ImgProcessor.src_image().
+            It is not modified
+        - size (int): Side of the hash grid. The hashes have size * size bits. Default: 8
+
+    Returns:
+        - Tuple[int, int]: aHash and dHash of the image
+    """
+
+    height, width = img.shape[:2]
+    factor = HASH_SOURCE_SIDE / max(height, width)
+    if factor < 1:
+        new_size = (max(1, int(width * factor)), max(1, int(height * factor)))
+        img = cv.resize(img, new_size, interpolation=cv.INTER_AREA)
+    gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    avg = cv.resize(gray, (size, size), interpolation=cv.INTER_AREA)
+    diff = cv.resize(gray, (size + 1, size), interpolation=cv.INTER_AREA)
+    return _bits_to_int(avg > avg.mean()), _bits_to_int(diff[:, 1:] > diff[:, :-1])
+
+
+def hamming(a: int, b: int) -> int:
+    """Number of bits that differ between two hashes"""
+
+    return bin(a ^ b).count("1")
+
+
+class PerceptualIndex:
+    """Persistent nearest-neighbour lookup of processed images by perceptual hash
+
+    Candidates must have the same effects and the same width and height, and are found
+    by exact match on any band of the dHash: two hashes within max_distance bits of
+    each other share at least one band when max_distance < BANDS.
+    """
+
+    def __init__(
+        self,
+        path: str = ":memory:",
+        max_distance: int = 3,
+        max_entries: int = 10000,
+        max_bytes: int = 1 << 28,
+    ):
+        """
+        Args:
+            - path (str): SQLite database file. Default: in memory, not persistent
+            - max_distance (int): Maximum differing bits on each hash to consider two
+                images near-identical. Between 0 and BANDS - 1. Default: 3
+            - max_entries (int): Stored outputs. The oldest are evicted first. Default: 10000
+            - max_bytes (int): Total size of the stored outputs. The oldest are
+                evicted first. Default: 256 MiB
+        """
+        self.max_distance = min(max(0, max_distance), BANDS - 1)
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(1, max_bytes)
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        bands = ", ".join(f"b{n} INTEGER" for n in range(BANDS))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY, effects TEXT, width INTEGER, height INTEGER, "
+            f"ahash TEXT, dhash TEXT, {bands}, size INTEGER, output BLOB)"
+        )
+        for n in range(BANDS):
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS entries_b{n} ON entries (effects, b{n})")
+        self._db.commit()
+
+    def _bands(self, dhash: int) -> List[int]:
+        return [(dhash >> (16 * n)) & 0xFFFF for n in range(BANDS)]
+
+    def lookup(
+        self, ahash: int, dhash: int, effects: List[str], width: int, height: int
+    ) -> Optional[bytes]:
+        """Find the stored output of the closest near-identical image
+
+        Args:
+            - ahash (int): aHash of the new image
+            - dhash (int): dHash of the new image
+            - effects (List[str]): effects to apply to image. Only outputs for the
+                same effects, in the same order, are considered
+            - width (int): Width of the new image. Only images as wide are considered
+            - height (int): Height of the new image. Only images as high are considered
+
+        Returns:
+            - bytes: Stored output, or None when there is no near-identical image
+        """
+
+        where = " OR ".join(f"b{n} = ?" for n in range(BANDS))
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, ahash, dhash FROM entries "
+                f"WHERE effects = ? AND width = ? AND height = ? AND ({where})",
+                [dumps(effects), width, height] + self._bands(dhash),
+            ).fetchall()
+            best, best_distance = None, None
+            for row_id, row_ahash, row_dhash in rows:
+                a_distance = hamming(ahash, int(row_ahash, 16))
+                d_distance = hamming(dhash, int(row_dhash, 16))
+                if max(a_distance, d_distance) > self.max_distance:
+                    continue
+                if best_distance is None or a_distance + d_distance < best_distance:
+                    best, best_distance = row_id, a_distance + d_distance
+            if best is None:
+                return None
+            row = self._db.execute("SELECT output FROM entries WHERE id = ?", (best,)).fetchone()
+        return row[0] if row else None
+
+    def add(
+        self, ahash: int, dhash: int, effects: List[str], width: int, height: int, output: bytes
+    ) -> None:
+        """Store the output of a processed image
+
+        Args:
+            - ahash (int): aHash of the original image
+            - dhash (int): dHash of the original image
+            - effects (List[str]): effects applied to image
+            - width (int): Width of the original image
+            - height (int): Height of the original image
+            - output (bytes-like): processed image
+        """
+
+        output = memoryview(output).cast("B")
+        if len(output) > self.max_bytes:
+            return
+        columns = ", ".join(f"b{n}" for n in range(BANDS))
+        marks = ", ".join("?" * (BANDS + 7))
+        with self._lock:
+            # The insert opens a write transaction: other processes sharing the file
+            # can't change the entries until the eviction below is committed
+            self._db.execute(
+                "INSERT INTO entries "
+                f"(effects, width, height, ahash, dhash, {columns}, size, output) "
+                f"VALUES ({marks})",
+                [dumps(effects), width, height, f"{ahash:x}", f"{dhash:x}"]
+                + self._bands(dhash)
+                + [len(output), output],
+            )
+            self._db.execute(
+                "DELETE FROM entries WHERE id <= (SELECT MAX(id) FROM entries) - ?",
+                (self.max_entries,),
+            )
+            excess = self._db.execute("SELECT SUM(size) FROM entries").fetchone()[0]
+            excess -= self.max_bytes
+            oldest = None
+            for row_id, size in self._db.execute("SELECT id, size FROM entries ORDER BY id"):
+                if excess <= 0:
+                    break
+                oldest, excess = row_id, excess - size
+            if oldest is not None:
+                self._db.execute("DELETE FROM entries WHERE id <= ?", (oldest,))
+            self._db.commit()
+
+    def close(self) -> None:
+        """Close the database"""
+
+        with self._lock:
+            self._db.close()
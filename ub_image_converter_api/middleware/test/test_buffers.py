@@ -0,0 +1,125 @@
+"""
+Unittests for the pooled buffers
+"""
+from base64 import b64decode, b64encode
+from io import BytesIO
+from json import dumps
+from pathlib import Path
+
+from ..buffers import (
+    BufferPool,
+    b64decode_into,
+    b64encode_into,
+    iter_chunks,
+    loads_with_b64_field,
+    read_into,
+)
+
+
+with open(f"{Path(__file__).parent.absolute()}/text.b64", "r") as f:
+    txt = f.read()
+
+
+def test_pool_reuses_blocks():
+    """Released blocks are handed out again for the same size class"""
+    pool = BufferPool(min_size=16, max_free=1)
+    buf = pool.acquire(20)
+    assert buf.capacity == 32
+    block = buf.block
+    buf.release()
+    with pool.acquire(17) as again:
+        assert again.block is block and again.length == 0
+    with pool.acquire(40) as bigger:
+        assert bigger.capacity == 64
+
+
+def test_pool_discards_over_max_free():
+    """Only max_free blocks per size class are kept"""
+    pool = BufferPool(min_size=16, max_free=1)
+    first, second = pool.acquire(16), pool.acquire(16)
+    first.release()
+    second.release()
+    assert pool.acquire(16).block is first.block
+
+
+def test_pool_caps_retained_bytes():
+    """Free blocks are only kept up to max_retained bytes in total"""
+    pool = BufferPool(min_size=16, max_retained=48)
+    small, large = pool.acquire(16), pool.acquire(64)
+    large.release()
+    small.release()
+    assert pool.retained == 16
+    assert pool.acquire(64).block is not large.block
+    assert pool.acquire(16).block is small.block and pool.retained == 0
+
+
+def test_release_is_idempotent():
+    """A buffer released twice is only given back once"""
+    pool = BufferPool(min_size=16)
+    buf = pool.acquire(16)
+    buf.release()
+    buf.release()
+    assert pool.acquire(16).block is buf.block
+    assert pool.acquire(16).block is not buf.block
+
+
+def test_b64decode_into():
+    """Chunked decoding matches b64decode, including misaligned inputs"""
+    pool = BufferPool()
+    with b64decode_into(txt, pool, chunk=1000) as buf:
+        assert buf.view() == b64decode(txt)
+    noisy = "\n".join(txt[i : i + 77] for i in range(0, len(txt), 77))
+    with b64decode_into(noisy, pool, chunk=1000) as buf:
+        assert buf.view() == b64decode(txt)
+    with b64decode_into("", pool) as buf:
+        assert not buf.view()
+    with b64decode_into(txt.encode(), pool, chunk=1000) as buf:
+        assert buf.view() == b64decode(txt)
+
+
+def test_b64decode_into_early_padding():
+    """Padding before the last chunk stops decoding, as b64decode does"""
+    pool = BufferPool()
+    for data in ["J0xnWw/=fUA==", b"J0xnWw/=fUA==", "J0xn=Ww/fUA=="]:
+        with b64decode_into(data, pool, chunk=4) as buf:
+            assert buf.view() == b64decode(data)
+
+
+def test_b64encode_into():
+    """Encoded output is wrapped between prefix and suffix"""
+    pool = BufferPool()
+    img = b64decode(txt)
+    with b64encode_into(img, pool, prefix=b"<", suffix=b">", chunk=999) as buf:
+        assert buf.view() == b"<" + b64encode(img) + b">"
+        assert b"".join(iter_chunks(buf, chunk=1000)) == bytes(buf.view())
+
+
+def test_read_into():
+    """Streams are read whole, with or without a known length"""
+    pool = BufferPool(min_size=16)
+    data = txt.encode()
+    with read_into(BytesIO(data), pool, len(data)) as buf:
+        assert buf.view() == data
+    with read_into(BytesIO(data), pool) as buf:
+        assert buf.view() == data
+    with read_into(BytesIO(data), pool, 10) as buf:
+        assert buf.view() == data[:10]
+
+
+def test_loads_with_b64_field():
+    """The base64 field is left as a view over the document, only when it is top-level"""
+    img = txt.replace("\n", "")
+    body = memoryview(dumps({"effects": ["negative"], "img": img, "extra": 1}).encode())
+    document = loads_with_b64_field(body, "img")
+    assert isinstance(document["img"], memoryview) and document["img"] == img.encode()
+    assert document["effects"] == ["negative"] and document["extra"] == 1
+
+    # Escaped line breaks need the regular parser
+    body = memoryview(dumps({"effects": [], "img": txt}).encode())
+    assert loads_with_b64_field(body, "img") == {"effects": [], "img": txt}
+
+    nested = {"meta": {"img": "AAAA"}, "img": "QUJD", "effects": []}
+    assert loads_with_b64_field(memoryview(dumps(nested).encode()), "img") == nested
+    escaped = memoryview(b'{"img": "\\/9j", "effects": []}')
+    assert loads_with_b64_field(escaped, "img") == {"img": "/9j", "effects": []}
+    assert loads_with_b64_field(memoryview(b"[1]"), "img") == [1]
@@ -0,0 +1,118 @@
+"""
+Unittests for the overload controller
+"""
+from base64 import b64decode
+from json import loads
+from pathlib import Path
+
+import cv2 as cv  # type: ignore
+import numpy as np
+
+from ...effects_processor.main import ImgProcessor
+from ..overload import DegradePolicy, OverloadController
+from ..response import RequestHandler
+
+
+with open(f"{Path(__file__).parent.absolute()}/text.b64", "r") as f:
+    txt = f.read()
+
+
+def decoded_shape(response: dict) -> tuple:
+    img = np.frombuffer(b64decode(response["img"]), np.uint8)
+    return cv.imdecode(img, cv.IMREAD_COLOR).shape[:2]
+
+
+def test_policy_by_depth():
+    """Policies follow the number of requests in flight"""
+    controller = OverloadController(degrade_depth=2, reject_depth=3)
+    assert controller.policy() is None
+    with controller.track():
+        assert controller.policy() is None
+        with controller.track():
+            policy = controller.policy()
+            assert policy is not None and not policy.reject_low_priority
+            with controller.track():
+                assert controller.policy().reject_low_priority
+    assert controller.in_flight == 0 and len(controller.latencies) == 3
+    assert controller.policy() is None
+
+
+def test_policy_by_latency():
+    """Slow recent requests degrade processing"""
+    controller = OverloadController(latency_threshold=0.5, window=10)
+    controller.latencies.extend([0.1] * 9 + [1.0])
+    assert controller.policy() is None
+    controller.latencies.extend([1.0] * 2)
+    assert controller.policy() is not None
+
+
+def test_RequestHandler_degraded():
+    """Degraded responses are flagged and scaled down"""
+    request = {"img": txt, "effects": ["blur"]}
+    full = loads(RequestHandler(request).build_response())
+    assert "degraded" not in full
+
+    class Saturated(OverloadController):
+        def policy(self):
+            return DegradePolicy(max_side=200)
+
+    degraded = loads(RequestHandler(request, overload=Saturated()).build_response())
+    assert degraded["degraded"] is True and max(decoded_shape(degraded)) == 200
+    assert len(degraded["img"]) < len(full["img"])
+
+
+def test_RequestHandler_rejects_low_priority():
+    """Only low priority requests are rejected when shedding"""
+
+    class Shedding(OverloadController):
+        def policy(self):
+            return DegradePolicy(max_side=200, reject_low_priority=True)
+
+    request = {"img": txt, "effects": ["negative"], "priority": "low"}
+    assert RequestHandler(request, overload=Shedding()).build_response() == {
+        "cod": 5,
+        "msg": "Server overloaded, try again later",
+    }
+    request["priority"] = "high"
+    response = loads(RequestHandler(request, overload=Shedding()).build_response())
+    assert response["degraded"] is True
+
+
+class Saturated(OverloadController):
+    def policy(self):
+        return DegradePolicy()
+
+
+def test_RequestHandler_degraded_kernels(monkeypatch):
+    """Degraded kernel based effects run with a smaller factor than their default"""
+    defaults = {"blur": 35, "laplacian": 5, "sobel": 3}
+    effects = list(defaults)
+    factors = dict()
+    for name in effects:
+
+        def spy(self, factor=None, _name=name, _effect=getattr(ImgProcessor, name)):
+            factors[_name] = factor
+            return _effect(self) if factor is None else _effect(self, factor)
+
+        monkeypatch.setattr(ImgProcessor, name, spy)
+
+    RequestHandler({"img": txt, "effects": effects}).build_response()
+    assert factors == {name: None for name in effects}
+    RequestHandler({"img": txt, "effects": effects}, overload=Saturated()).build_response()
+    assert all(factors[name] < default for name, default in defaults.items())
+
+
+def test_RequestHandler_degraded_final_encode(monkeypatch):
+    """Only the final output uses the policy's encoder settings"""
+    params = []
+    imencode = cv.imencode
+
+    def spy(ext, img, flags=()):
+        params.append(list(flags))
+        return imencode(ext, img, flags)
+
+    monkeypatch.setattr(cv, "imencode", spy)
+    request = {"img": txt, "effects": ["negative", "flip"]}
+    RequestHandler(request, overload=Saturated()).build_response()
+    assert params[-1] == DegradePolicy().encode_params
+    assert params[:-1] and not any(params[:-1])
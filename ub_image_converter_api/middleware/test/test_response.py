@@ -1,5 +1,6 @@
 from typing import Any, Dict, List, Optional
 from pathlib import Path
+from ..buffers import BufferPool, PooledBuffer
 from ..response import RequestHandler
 
 def makeRequest(effects: Optional[List[str]], fileb64: Optional[str], malformed: bool=False) -> Dict:
@@ -95,3 +96,14 @@ def test_RequestHandler_constructor():
     req = makeRequest(effects=effects, fileb64="text.b64")
     rh = RequestHandler(req)
     assert rh.request == req
+
+
+def test_RequestHandler_pooled_response():
+    pool = BufferPool()
+    req = makeRequest(effects=["negative"], fileb64="text.b64")
+    expected = RequestHandler(req).build_response()
+    with RequestHandler(req, pool=pool).build_response() as buf:
+        assert isinstance(buf, PooledBuffer)
+        assert buf.view() == expected.encode()
+    r = RequestHandler(makeRequest(effects=[], fileb64="text.b64"), pool=pool)
+    assert r.build_response() == error_json("noEffects")
@@ -0,0 +1,99 @@
+"""
+Unittests for the near-duplicate index
+"""
+from base64 import b64decode, b64encode
+from json import loads
+from pathlib import Path
+
+import cv2 as cv  # type: ignore
+import numpy as np
+
+from ...effects_processor.main import ImgProcessor
+from ..response import RequestHandler
+from ..similarity import PerceptualIndex, hamming, image_hashes
+
+
+with open(f"{Path(__file__).parent.absolute()}/text.b64", "r") as f:
+    txt = f.read()
+    image = b64decode(txt)
+
+src = cv.imdecode(np.frombuffer(image, np.uint8), cv.IMREAD_COLOR)
+reencoded = cv.imencode(".jpg", src, [cv.IMWRITE_JPEG_QUALITY, 60])[1].tobytes()
+
+
+def test_reencoded_hashes_are_close():
+    """A re-encoded image hashes close to the original, its negative does not"""
+    i_p = ImgProcessor(image)
+    ahash, dhash = image_hashes(i_p.src_image())
+    assert i_p.dst_image() is image  # Hashing leaves the processor untouched
+    re_ahash, re_dhash = image_hashes(ImgProcessor(reencoded).src_image())
+    assert hamming(ahash, re_ahash) <= 3 and hamming(dhash, re_dhash) <= 3
+    neg_ahash, _ = image_hashes(cv.bitwise_not(src))
+    assert hamming(ahash, neg_ahash) > 32
+
+
+def test_index_lookup(tmp_path):
+    """Lookups match on near-identical hashes and same effects, and persist"""
+    path = str(tmp_path / "index.sqlite3")
+    index = PerceptualIndex(path, max_distance=2)
+    index.add(0xFF, 0xF0F0, ["negative"], 640, 480, b"output")
+    assert index.lookup(0xFE, 0xF0F1, ["negative"], 640, 480) == b"output"
+    assert index.lookup(0xFF, 0xF0F0, ["blur"], 640, 480) is None
+    assert index.lookup(0xF0, 0xF0F0, ["negative"], 640, 480) is None
+    assert index.lookup(0xFF, 0xF0F0, ["negative"], 320, 240) is None
+    index.close()
+    assert PerceptualIndex(path).lookup(0xFF, 0xF0F0, ["negative"], 640, 480) == b"output"
+
+
+def test_index_eviction():
+    """Oldest entries are evicted over max_entries"""
+    index = PerceptualIndex(max_entries=1)
+    index.add(0, 0, ["negative"], 1, 1, b"old")
+    index.add(0, 0, ["blur"], 1, 1, b"new")
+    assert index.lookup(0, 0, ["negative"], 1, 1) is None
+    assert index.lookup(0, 0, ["blur"], 1, 1) == b"new"
+
+    index = PerceptualIndex(max_bytes=7)
+    index.add(0, 0, ["negative"], 1, 1, b"old")
+    index.add(0, 0, ["blur"], 1, 1, b"newer")
+    index.add(0, 0, ["flip"], 1, 1, b"too large")
+    assert index.lookup(0, 0, ["negative"], 1, 1) is None
+    assert index.lookup(0, 0, ["blur"], 1, 1) == b"newer"
+    assert index.lookup(0, 0, ["flip"], 1, 1) is None
+
+
+def test_index_eviction_shared_file(tmp_path):
+    """The byte limit holds for the file, not for each process using it"""
+    path = str(tmp_path / "index.sqlite3")
+    first, second = PerceptualIndex(path, max_bytes=8), PerceptualIndex(path, max_bytes=8)
+    first.add(0, 0, ["negative"], 1, 1, b"1111")
+    second.add(0, 0, ["blur"], 1, 1, b"2222")
+    first.add(0, 0, ["flip"], 1, 1, b"3333")
+    assert first.lookup(0, 0, ["negative"], 1, 1) is None
+    assert second.lookup(0, 0, ["blur"], 1, 1) == b"2222"
+    assert second.lookup(0, 0, ["flip"], 1, 1) == b"3333"
+
+
+def test_RequestHandler_approximate_reuse():
+    """Re-encoded uploads are served from the index only when allowed"""
+    index = PerceptualIndex()
+    request = {"img": txt, "effects": ["negative"]}
+    first = loads(RequestHandler(request, index=index).build_response())
+    assert "reused" not in first
+    request = {"img": b64encode(reencoded).decode(), "effects": ["negative"], "approximate": True}
+    reused = loads(RequestHandler(request, index=index).build_response())
+    same_img = reused["img"] == first["img"]
+    assert reused["reused"] is True and same_img
+    for approximate in [False, "false", "0", 1]:
+        request["approximate"] = approximate
+        assert "reused" not in loads(RequestHandler(request, index=index).build_response())
+
+
+def test_RequestHandler_no_reuse_across_resolutions():
+    """The same picture at another resolution is processed, not reused"""
+    index = PerceptualIndex()
+    RequestHandler({"img": txt, "effects": ["negative"]}, index=index).build_response()
+    small = cv.resize(src, (src.shape[1] // 8, src.shape[0] // 8), interpolation=cv.INTER_AREA)
+    img = b64encode(cv.imencode(".jpg", small)[1]).decode()
+    request = {"img": img, "effects": ["negative"], "approximate": True}
+    assert "reused" not in loads(RequestHandler(request, index=index).build_response())